@@ -1,50 +1,42 @@
 from datetime import datetime, timezone
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import os
 import getpass
-import random
+import sys
+import itertools
 import json
 import argparse
 from faker import Faker
+from faker.exceptions import UniquenessException
+import numpy as np
+import orjson
 
 
-def percent_roll_check(threshold: int):
-    """    
-    Roll a d100 and see if you pass the check
-    """
-
-    if random.randint(0, 100) <= threshold:
-        return False
-    
-    return True
-
-
-def get_random_items(from_list, max_items: int, chance_is_empty: int = 0):    
-    """
-    From a given iterable `from_list` get up to `max_items` number of items as a set
-    Additionally there is a `chance_is_empty` percent that returned set is empty
-    """
+# list of instagram tags, interned so every person's
+# tag dict is keyed by the same string objects
+TAGS = tuple(sys.intern(tag) for tag in [
+    '#love', '#fashion', '#photooftheday', '#beautiful', '#photography',
+    '#picoftheday', '#happy', '#follow', '#nature', '#tbt', '#instagram',
+    '#travel', '#like4like', '#style', '#repost', '#summer', '#instadaily',
+    '#selfie', '#beauty', '#girl', '#friends', '#instalike', '#me', 
+    '#smile', '#family', '#photo', '#life', '#likeforlike', '#music',
+    '#ootd', '#makeup', '#follow4follow', '#amazing', '#igers', '#nofilter',
+    '#model', '#sunset', '#beach', '#design', '#motivation', '#instamood',
+    '#foodporn', '#lifestyle', '#followforfollow', '#sky', '#l4l', '#f4f',
+    '#handmade', '#likeforlikes', '#cat',
+])
 
-    if chance_is_empty:
-        if not percent_roll_check(chance_is_empty):
-            return set()
-    
-    result = list()
-    number_of_items = random.randint(1, max_items)
+TAG_COUNT = len(TAGS)
 
-    for _ in range(number_of_items):
-        random_index = random.randint(0, len(from_list)-1)
-        result.append(from_list[random_index])
-    
-    # converting to a set removes duplicates as
-    # we haven't sampled without replacement
-    return set(result)
+# how many batches of names in a row can add nothing new
+# before we decide faker has run out of unique names
+MAX_UNIQUE_NAME_ATTEMPTS = 1000
 
 
-def generate_meta_data(fake: Faker, number_of_records: int, random_seed: int, start_index: int, end_index: int):
+def generate_meta_data(user: str, generated_at: datetime, number_of_records: int, random_seed: int, start_index: int, end_index: int):
     meta_data = dict()
 
-    generated_at = datetime.now()
-
     meta_data["generated_at"] = {
         "local": {
             "date": generated_at.date().isoformat(),
@@ -60,104 +52,191 @@ def generate_meta_data(fake: Faker, number_of_records: int, random_seed: int, st
         },
         "number_of_records": number_of_records
     }
-    meta_data["user"] = getpass.getuser()    
+    meta_data["user"] = user
     meta_data["random_seed"] = random_seed
 
     return meta_data
 
 
-def generate_people(fake: Faker, number_of_people: int):
-    # list of instagram tags
-    tags = [
-        '#love', '#fashion', '#photooftheday', '#beautiful', '#photography',
-        '#picoftheday', '#happy', '#follow', '#nature', '#tbt', '#instagram',
-        '#travel', '#like4like', '#style', '#repost', '#summer', '#instadaily',
-        '#selfie', '#beauty', '#girl', '#friends', '#instalike', '#me', 
-        '#smile', '#family', '#photo', '#life', '#likeforlike', '#music',
-        '#ootd', '#makeup', '#follow4follow', '#amazing', '#igers', '#nofilter',
-        '#model', '#sunset', '#beach', '#design', '#motivation', '#instamood',
-        '#foodporn', '#lifestyle', '#followforfollow', '#sky', '#l4l', '#f4f',
-        '#handmade', '#likeforlikes', '#cat',
-    ]
+def generate_unique_names(fake: Faker, number_of_names: int):
+    """
+    Generate `number_of_names` distinct names, without going through
+    Faker's `unique` proxy for every name
+    """
+
+    # a dict rather than a set keeps the names in the order
+    # they were generated, so the output is reproducible
+    names = dict()
+
+    # give up like Faker's `unique` proxy does if we keep
+    # drawing names we've already got, rather than loop forever
+    attempts_without_new_names = 0
+
+    while len(names) < number_of_names:
+        number_of_names_before = len(names)
+        names.update(dict.fromkeys(fake.name() for _ in range(number_of_names - len(names))))
+
+        if len(names) > number_of_names_before:
+            attempts_without_new_names = 0
+            continue
+
+        attempts_without_new_names += 1
+        if attempts_without_new_names >= MAX_UNIQUE_NAME_ATTEMPTS:
+            raise UniquenessException(
+                f"Got {len(names)} unique names after {MAX_UNIQUE_NAME_ATTEMPTS} attempts without a new one, "
+                f"could not generate {number_of_names}"
+            )
+
+    return list(names)
+
+
+def generate_people(fake: Faker, rng: np.random.Generator, number_of_people: int):
+    # each tag has a liked and a posted interaction
+    interactions = 2
+    max_tags = 8
+    max_friends = 10
+
+    # draw everything random we need for all the people in a few
+    # batched calls up front, rather than calling into `random`
+    # for every single value inside the loop below
+    number_of_tags = rng.integers(1, max_tags + 1, size=number_of_people, dtype=np.int8).tolist()
+    tag_indexes = rng.integers(0, TAG_COUNT, size=(number_of_people, max_tags), dtype=np.int8).tolist()
+    interaction_counts = rng.integers(0, 9, size=(number_of_people, max_tags, interactions), dtype=np.int8).tolist()
+    # make some of these tag interactions missing
+    keep_interactions = (rng.random((number_of_people, max_tags, interactions), dtype=np.float32) > 0.13).tolist()
+    # if you're the only person there's no one to be friends with
+    if number_of_people == 1:
+        max_friends = 0
+
+    number_of_friends = rng.integers(0, max_friends + 1, size=number_of_people)
+
+    # friend ids for everyone are laid end to end, person `i` has
+    # friend_ids[friend_offsets[i]:friend_offsets[i + 1]]
+    friend_offsets = np.concatenate(([0], np.cumsum(number_of_friends))).tolist()
+
+    # remove the possibility of being friends
+    # with oneself, although I do encourage 
+    # being your own best friend, by drawing from
+    # everyone else and stepping over our own id
+    friend_of = np.repeat(np.arange(1, number_of_people + 1, dtype=np.int32), number_of_friends)
+    friend_ids = rng.integers(1, number_of_people, size=friend_offsets[-1], dtype=np.int32)
+    friend_ids += friend_ids >= friend_of
+    friend_ids = friend_ids.tolist()
+
+    names = generate_unique_names(fake, number_of_people)
 
     people = list()
 
-    for i in range(number_of_people):    
+    for i in range(number_of_people):
+        person_id = i + 1
+
         new_person = {
-            "id": i + 1,
-            "name": fake.unique.name(),
+            "id": person_id,
+            "name": names[i],
         }
 
-        new_tags = get_random_items(tags, 8, 0)
-
         tag_interactions = dict()
-        
-        for tag in new_tags:
-            tag_interactions[tag] = dict()
-                    
-            for interaction in ["liked", "posted"]:
-                # make some of these tag interactions missing
-                if not percent_roll_check(13):
-                    continue
-                
-                tag_interactions[tag][interaction] = random.randint(0, 8)
+
+        for tag_index, (liked, posted), (keep_liked, keep_posted) in zip(
+            tag_indexes[i][:number_of_tags[i]],
+            interaction_counts[i],
+            keep_interactions[i],
+        ):
+            tag = TAGS[tag_index]
+
+            # we haven't sampled without replacement
+            # so skip any tag we've already drawn
+            if tag in tag_interactions:
+                continue
+
+            interactions_for_tag = dict()
+
+            if keep_liked:
+                interactions_for_tag["liked"] = liked
+            if keep_posted:
+                interactions_for_tag["posted"] = posted
+
+            tag_interactions[tag] = interactions_for_tag
 
         new_person["tags"] = tag_interactions
 
-        friends = list()    
-        number_of_friends = random.randint(0, 10)
-        for i in range(number_of_friends):
-            friends.append(random.randint(1, number_of_people))
-
-        # remove the possibility of being friends
-        # with oneself, although I do encourage 
-        # being your own best friend
-        try:
-            friends.remove(i)
-        except ValueError:
-            pass
-        
-        new_person["friends"] = friends
+        new_person["friends"] = friend_ids[friend_offsets[i]:friend_offsets[i + 1]]
 
         people.append(new_person)
     
     return people
 
 
-def generate_reciprocal_friends(people):
+def generate_reciprocal_friends(people, rng: np.random.Generator):
     """
     Is the friendship reciprocal?
     """
-    for index, person in enumerate(people):
+    number_of_people = len(people)
 
-        person_id = index + 1
+    number_of_friends = [len(person["friends"]) for person in people]
+    person_ids = np.repeat(np.arange(1, number_of_people + 1, dtype=np.int64), number_of_friends)
+    friend_ids = np.fromiter(
+        itertools.chain.from_iterable(person["friends"] for person in people),
+        dtype=np.int64,
+        count=sum(number_of_friends),
+    )
 
-        friends = person["friends"]
-        
-        for friend_id in friends:
-            friend_index = friend_id - 1
-            if not percent_roll_check(50):
-                continue
+    # each friendship gets a roll to see if it is reciprocated
+    is_reciprocal = rng.random(len(friend_ids)) > 0.5
+
+    # encode each (person, friend) pair as a single number so
+    # we can check against existing friendships all at once
+    friendships = person_ids * (number_of_people + 1) + friend_ids
+    reciprocal = friend_ids[is_reciprocal] * (number_of_people + 1) + person_ids[is_reciprocal]
 
-            friend = people[friend_index]
-            if person_id not in friend["friends"]:
-                friend["friends"].append(person_id) 
-            
-            people[friend_index] = friend
+    # np.unique also orders the new friendships by
+    # friend and then by the person being added
+    reciprocal = np.unique(reciprocal[~np.isin(reciprocal, friendships)])
+
+    new_friend_of, new_friend_ids = np.divmod(reciprocal, number_of_people + 1)
+    offsets = np.searchsorted(new_friend_of, np.arange(1, number_of_people + 2)).tolist()
+    new_friend_ids = new_friend_ids.tolist()
+
+    for index, person in enumerate(people):
+        person["friends"].extend(new_friend_ids[offsets[index]:offsets[index + 1]])
 
     return people
 
 
+def write_partition(output_file: str, meta_data: dict, people, start_index: int, end_index: int):
+    """
+    Write out the partition of `people` from `start_index` up to but
+    not including `end_index` along with its `meta_data`
+    """
+
+    # stream each person out rather than serialising the 
+    # whole partition into one buffer first, the output is
+    # the same as dumping {"meta_data": ..., "data": [...]}
+    with open(output_file, 'wb', buffering=1 << 20) as outfile:
+        outfile.write(b'{"meta_data":')
+        outfile.write(orjson.dumps(meta_data))
+        outfile.write(b',"data":[')
+
+        # index straight into `people` rather than 
+        # taking a copy of the partition with a slice
+        for index in range(start_index, end_index):
+            if index > start_index:
+                outfile.write(b',')
+            outfile.write(orjson.dumps(people[index]))
+
+        outfile.write(b']}')
+
+
 def execute(number_of_people, random_seed, number_of_partitions, output_path):
     # initialise faker and set our seeds
     fake = Faker()
 
     Faker.seed(random_seed)
-    random.seed(random_seed)
+    rng = np.random.default_rng(random_seed)
 
     # make some fake data    
-    people = generate_people(fake, number_of_people)    
-    people = generate_reciprocal_friends(people)
+    people = generate_people(fake, rng, number_of_people)    
+    people = generate_reciprocal_friends(people, rng)
     
     # assumes we've got even division
     records_per_partition = int(number_of_people / number_of_partitions)
@@ -169,24 +248,32 @@ def execute(number_of_people, random_seed, number_of_partitions, output_path):
         print(f"Could not create or access the path: {output_path}")
         raise e
 
+    # these are the same for every partition so only look them up
+    # once, resolving the local timezone here rather than per partition
+    user = getpass.getuser()
+    generated_at = datetime.now().astimezone()
+
+    partitions = list()
+
     for i in range(number_of_partitions):
         start_index = i * records_per_partition
         end_index = start_index + records_per_partition
 
-        people_in_partition = people[start_index:end_index]
+        meta_data = generate_meta_data(user, generated_at, end_index - start_index, random_seed, start_index, end_index - 1)
+
+        partitions.append((f"{output_path}/{i+1}.json", meta_data, people, start_index, end_index))
 
-        meta_data = generate_meta_data(fake, len(people_in_partition), random_seed, start_index, end_index - 1)
+    # the partitions don't depend on each other so write them out concurrently
+    max_workers = min(number_of_partitions, os.cpu_count() or 1)
 
-        data = {
-            "meta_data": meta_data,
-            "data": people_in_partition,
-            }
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        writes = [executor.submit(write_partition, *partition) for partition in partitions]
 
-        with open(f"{output_path}/{i+1}.json", 'w') as outfile:
-            json.dump(data, outfile)
+        for write, (_, meta_data, *_) in zip(writes, partitions):
+            write.result()
 
-        print
-        print(json.dumps(meta_data, indent=4))
+            print
+            print(json.dumps(meta_data, indent=4))
 
 
 if __name__ == '__main__':